@@ -1,3 +1,5 @@
+{{ config(indexes=[{'columns': ['country_code', 'year']}]) }}
+
 SELECT
     country_code,
     country_name,
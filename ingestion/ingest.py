@@ -4,6 +4,8 @@ import logging
 import requests
 from datetime import datetime
 from minio import Minio
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ------------------------
 # Logging configuration
@@ -26,6 +28,23 @@ MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "minio:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 
+# (connect, read) timeouts in seconds for the WHO download
+HTTP_TIMEOUT = (5, 60)
+
+# ------------------------
+# HTTP session
+# ------------------------
+# One keep-alive session per process: the connection pool is reused across
+# retries (and across calls when main() runs inside a long-lived worker).
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
 # ------------------------
 # Main logic
 # ------------------------
@@ -35,16 +54,6 @@ def main():
 
     logging.info("Starting WHO GHO data ingestion (JSON)")
 
-    # Download JSON (OData format: { "value": [ ... ] }); store raw bytes (no parse in ingestion)
-    response = requests.get(WHO_URL)
-    response.raise_for_status()
-    size_mb = len(response.content) / (1024 * 1024)
-    logging.info("Downloaded WHO life expectancy JSON (%.2f MB)", size_mb)
-
-    local_file = "/tmp/life_expectancy.json"
-    with open(local_file, "wb") as f:
-        f.write(response.content)
-
     # Connect to MinIO
     client = Minio(
         MINIO_ENDPOINT,
@@ -58,13 +67,31 @@ def main():
         client.make_bucket(BUCKET_NAME)
         logging.info("Created bucket: %s", BUCKET_NAME)
 
-    # Upload to MinIO
-    client.fput_object(
-        BUCKET_NAME,
-        object_path,
-        local_file,
-        content_type="application/json",
-    )
+    # Stream JSON (OData format: { "value": [ ... ] }) straight from the HTTP socket into MinIO;
+    # store raw bytes (no parse in ingestion, no local temp file). The with block returns the
+    # pooled connection to the session on every path, including errors.
+    with _session.get(WHO_URL, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        # Content-Length is only usable when the body is not content-encoded (decode_content
+        # yields decompressed bytes); otherwise let MinIO do a multipart upload of unknown
+        # length in 10 MB parts.
+        content_length = response.headers.get("Content-Length")
+        if content_length is not None and not response.headers.get("Content-Encoding"):
+            length, part_size = int(content_length), 0
+            logging.info("Streaming WHO life expectancy JSON (%.2f MB)", length / (1024 * 1024))
+        else:
+            length, part_size = -1, 10 * 1024 * 1024
+            logging.info("Streaming WHO life expectancy JSON (size unknown)")
+        client.put_object(
+            BUCKET_NAME,
+            object_path,
+            response.raw,
+            length=length,
+            part_size=part_size,
+            content_type="application/json",
+        )
 
     logging.info("Uploaded raw JSON to MinIO: %s", object_path)
     logging.info("Ingestion completed successfully")
@@ -3,6 +3,7 @@ import sys
 import time
 import logging
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 # Suppress warnings before importing mlflow/sklearn
 warnings.filterwarnings("ignore", message=".*Git.*")
@@ -10,14 +11,17 @@ warnings.filterwarnings("ignore", message=".*artifact_path.*")
 warnings.filterwarnings("ignore", message=".*pickle or cloudpickle.*")
 warnings.filterwarnings("ignore", message=".*inferring pip requirements.*")
 
+import connectorx as cx
+import joblib
+import numpy as np
 import pandas as pd
 import mlflow
 import mlflow.sklearn
-from sqlalchemy import create_engine
+from mlflow.entities import Metric, Param
+from mlflow.tracking import MlflowClient
 from sklearn.linear_model import LinearRegression
 from sklearn.tree import DecisionTreeRegressor
 from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 
@@ -36,25 +40,46 @@ POSTGRES_USER = os.getenv("POSTGRES_USER", "warehouse_user")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "warehouse_pass")
 MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://mlflow:5000")
 EXPERIMENT_NAME = "life_expectancy_prediction"
+FEATURE_CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", "/tmp/mlcache")
 
 DATABASE_URL = (
     f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:5432/{POSTGRES_DB}"
 )
 
+# Feature frames are memoized on the schema and a content hash of the mart data
+# (FEATURE_CACHE_DIR is a named volume in docker-compose, so hits survive across runs)
+_feature_cache = joblib.Memory(FEATURE_CACHE_DIR, verbose=0)
+
+# Model pickling + artifact upload runs here while the next model trains
+_upload_pool = ThreadPoolExecutor(max_workers=2)
+
 
 def wait_for_mlflow(max_wait_sec=120):
-    import urllib.request
-    import urllib.error
-    base = MLFLOW_TRACKING_URI.rstrip("/")
-    url = f"{base}/health" if not base.endswith("/health") else base
-    start = time.time()
-    while time.time() - start < max_wait_sec:
-        try:
-            urllib.request.urlopen(url, timeout=2)
-            return
-        except (OSError, urllib.error.URLError):
-            logging.warning("MLflow not ready yet, retrying in 5s...")
-            time.sleep(5)
+    import http.client
+    import urllib.parse
+    parts = urllib.parse.urlsplit(MLFLOW_TRACKING_URI)
+    path = parts.path.rstrip("/")
+    path = path if path.endswith("/health") else f"{path}/health"
+    conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    # One keep-alive connection across polls; http.client reconnects by itself after close()
+    conn = conn_cls(parts.hostname, parts.port, timeout=2)
+    deadline = time.monotonic() + max_wait_sec
+    delay = 0.25
+    try:
+        while time.monotonic() < deadline:
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()  # drain so the connection can be reused
+                if response.status == 200:
+                    return
+            except (OSError, http.client.HTTPException):
+                conn.close()
+            logging.warning("MLflow not ready yet, retrying in %.2fs...", delay)
+            time.sleep(delay)
+            delay = min(delay * 2, 4)
+    finally:
+        conn.close()
     raise RuntimeError(
         "MLflow did not become ready in time. Run: docker compose up -d and wait ~30s before ./run.sh ml"
     )
@@ -66,8 +91,10 @@ def load_data():
         FROM mart_country_life_expectancy
         WHERE avg_life_expectancy IS NOT NULL
     """
-    engine = create_engine(DATABASE_URL)
-    df = pd.read_sql(query, engine)
+    # Columnar, partitioned read straight into pandas (no row-by-row DB-API fetch)
+    df = cx.read_sql(
+        DATABASE_URL, query, partition_on="year", partition_num=4, return_type="pandas"
+    )
     if df.empty or len(df) < 10:
         raise ValueError(
             "No data (or too few rows) in mart_country_life_expectancy. "
@@ -76,40 +103,104 @@ def load_data():
     return df
 
 
-def prepare_features(df):
-    le = LabelEncoder()
-    df = df.copy()
-    df["country_encoded"] = le.fit_transform(df["country_code"].astype(str))
-    df["year_sq"] = df["year"] ** 2
+@_feature_cache.cache(ignore=["df"])
+def _prepare(df_key, df):
+    """Build (X, y, feature_cols, countries); cached on df_key only, df itself is not hashed."""
+    # Same sorted-category codes as LabelEncoder, via pandas' C hash table
+    countries = pd.Categorical(df["country_code"].astype(str))
+    year = df["year"].to_numpy(dtype=np.int16)
+    year_sq = np.multiply(year, year, dtype=np.int32)
+    X = pd.DataFrame({
+        "year": year,
+        "year_sq": year_sq,
+        "country_encoded": countries.codes.astype(np.int32),
+    }, index=df.index)
     feature_cols = ["year", "year_sq", "country_encoded"]
-    X = df[feature_cols]
     y = df["avg_life_expectancy"]
-    return X, y, feature_cols, le
+    return X, y, feature_cols, countries
+
+
+def prepare_features(df):
+    # Schema (column names + dtypes) and a content hash; row hashes alone ignore the schema
+    df_key = (
+        tuple(df.columns),
+        tuple(str(dtype) for dtype in df.dtypes),
+        len(df),
+        int(pd.util.hash_pandas_object(df, index=False).sum()),
+    )
+    return _prepare(df_key, df)
 
 
-def train_and_log(model, model_name, X_train, X_test, y_train, y_test, feature_cols):
-    """Train one model, log to MLflow, return test R²."""
+def _log_model(model, run_id):
+    # The active-run stack is thread-local, so resume the run in this worker thread. Leaving
+    # this context is the run's only terminal transition (FINISHED, or FAILED on error), so
+    # the run is never reported finished before its model artifact exists.
+    with mlflow.start_run(run_id=run_id):
+        # Default serialization (no skops) so all sklearn models log without untrusted-type errors
+        mlflow.sklearn.log_model(model, name="model")
+
+
+def _loocv_r2(X, y):
+    """Leave-one-out R² of OLS (with intercept) via the PRESS identity: one SVD, no refits.
+
+    Returns None when the identity does not apply (rank-deficient design or a leverage of ~1);
+    the caller then falls back to cross_val_score.
+    """
+    design = np.column_stack([np.ones(len(X)), np.asarray(X, dtype=np.float64)])
+    # Column scaling leaves the hat matrix unchanged but makes the rank tolerance meaningful
+    norms = np.linalg.norm(design, axis=0)
+    design /= np.where(norms > 0, norms, 1.0)
+    u, s, _ = np.linalg.svd(design, full_matrices=False)
+    keep = s > s[0] * max(design.shape) * np.finfo(np.float64).eps
+    if not keep.all():
+        return None
+    # Hat matrix H = UUᵀ over the kept singular vectors: fitted values UUᵀy, leverages diag(H)
+    u = u[:, keep]
+    h = np.einsum("ij,ij->i", u, u)
+    if np.any(1 - h <= 1e-8):
+        return None
+    y = np.asarray(y, dtype=np.float64)
+    resid = y - u @ (u.T @ y)
+    press = ((resid / (1 - h)) ** 2).sum()
+    return 1 - press / ((y - y.mean()) ** 2).sum()
+
+
+def train_and_log(model, model_name, run_id, X_train, X_test, y_train, y_test, feature_cols):
+    """Train one model, log to MLflow run run_id, return test R² and the pending model-upload future."""
     model.fit(X_train, y_train)
     preds = model.predict(X_test)
     mse = mean_squared_error(y_test, preds)
     r2 = r2_score(y_test, preds)
     mae = mean_absolute_error(y_test, preds)
-    cv_r2 = cross_val_score(model, X_train, y_train, cv=5, scoring="r2").mean()
+    # Closed-form leave-one-out CV for OLS instead of refitting per fold, when it applies
+    cv_r2 = _loocv_r2(X_train, y_train) if isinstance(model, LinearRegression) else None
+    if cv_r2 is None:
+        cv_r2 = cross_val_score(
+            model, X_train, y_train, cv=5, scoring="r2", n_jobs=-1
+        ).mean()
 
-    mlflow.log_param("model_type", model_name)
-    mlflow.log_param("features", ",".join(feature_cols))
-    mlflow.log_metric("mse", mse)
-    mlflow.log_metric("r2", r2)
-    mlflow.log_metric("mae", mae)
-    mlflow.log_metric("cv_r2_mean", cv_r2)
+    # One log_batch RPC instead of a round-trip per param/metric
+    ts = int(time.time() * 1000)
+    MlflowClient().log_batch(
+        run_id,
+        metrics=[
+            Metric("mse", float(mse), ts, 0),
+            Metric("r2", float(r2), ts, 0),
+            Metric("mae", float(mae), ts, 0),
+            Metric("cv_r2_mean", float(cv_r2), ts, 0),
+        ],
+        params=[
+            Param("model_type", model_name),
+            Param("features", ",".join(feature_cols)),
+        ],
+    )
 
-    # Default serialization (no skops) so all sklearn models log without untrusted-type errors
-    mlflow.sklearn.log_model(model, name="model")
+    upload = _upload_pool.submit(_log_model, model, run_id)
 
     logging.info(
         f"  {model_name} — MSE: {mse:.2f}, R2: {r2:.2f}, MAE: {mae:.2f} years"
     )
-    return r2
+    return r2, upload
 
 
 def main():
@@ -117,7 +208,8 @@ def main():
 
     wait_for_mlflow()
     mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-    mlflow.set_experiment(EXPERIMENT_NAME)
+    experiment = mlflow.set_experiment(EXPERIMENT_NAME)
+    client = MlflowClient()
 
     df = load_data()
     X, y, feature_cols, _ = prepare_features(df)
@@ -134,25 +226,47 @@ def main():
         ),
         (
             RandomForestRegressor(
-                n_estimators=100, max_depth=12, min_samples_leaf=3, random_state=42
+                n_estimators=100,
+                max_depth=12,
+                min_samples_leaf=3,
+                random_state=42,
+                n_jobs=-1,
             ),
             "RandomForestRegressor",
         ),
         (
             HistGradientBoostingRegressor(
-                max_iter=300, max_depth=8, min_samples_leaf=4, random_state=42
+                max_iter=300,
+                max_depth=8,
+                min_samples_leaf=4,
+                early_stopping=True,
+                n_iter_no_change=15,
+                validation_fraction=0.1,
+                random_state=42,
             ),
             "HistGradientBoostingRegressor",
         ),
     ]
 
     results = []
+    uploads = []
     for model, name in models:
-        with mlflow.start_run(run_name=name):
-            r2 = train_and_log(
-                model, name, X_train, X_test, y_train, y_test, feature_cols
+        # Created, not started: the upload worker ends the run once the model is logged
+        run_id = client.create_run(experiment.experiment_id, run_name=name).info.run_id
+        try:
+            r2, upload = train_and_log(
+                model, name, run_id, X_train, X_test, y_train, y_test, feature_cols
             )
-            results.append((name, r2))
+        except Exception:
+            client.set_terminated(run_id, status="FAILED")
+            raise
+        results.append((name, r2))
+        uploads.append(upload)
+
+    # Surface any model upload errors before reporting success
+    for upload in uploads:
+        upload.result()
+    _upload_pool.shutdown()
 
     best_name = max(results, key=lambda x: x[1])[0]
     logging.info("ML job finished successfully")
@@ -1,11 +1,11 @@
 """Integration test: verify data was loaded into the warehouse.
    Run after pipeline (e.g. inside Docker network where 'postgres' resolves)."""
 import os
-import psycopg2
+import psycopg
 
 
 def test_data_loaded_into_warehouse():
-    conn = psycopg2.connect(
+    conn = psycopg.connect(
         host=os.getenv("POSTGRES_HOST", "postgres"),
         dbname=os.getenv("POSTGRES_DB", "warehouse"),
         user=os.getenv("POSTGRES_USER", "warehouse_user"),
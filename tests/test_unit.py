@@ -7,7 +7,7 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 import pandas as pd
 import pytest
-from transformations.transform import validate_data
+from transformations.transform import copy_rows, load_raw_file, validate_data
 
 
 def test_validate_data_passes_on_clean_data():
@@ -44,3 +44,67 @@ def test_validate_data_fails_on_duplicates():
 
     with pytest.raises(ValueError):
         validate_data(df)
+
+
+def test_copy_rows_writes_missing_values_as_none():
+    df = pd.DataFrame({
+        "country_name": [None, "Kenya"],
+        "country_code": ["RWA", "KEN"],
+        "year": [2020, 2020],
+        "sex": ["Both sexes", "Both sexes"],
+        "life_expectancy": [69.3, 66.7]
+    })
+
+    rows = list(copy_rows(df))
+
+    assert rows == [(None, "RWA", 2020, "Both sexes", 69.3), ("Kenya", "KEN", 2020, "Both sexes", 66.7)]
+
+
+def test_load_raw_file_json_keeps_both_sexes_rows():
+    payload = (
+        b'{"value": ['
+        b'{"SpatialDim": "RWA", "TimeDim": 2020, "Dim1": "SEX_MLE", "NumericValue": 67.1},'
+        b'{"SpatialDim": "RWA", "TimeDim": 2020, "Dim1": "SEX_BTSX", "NumericValue": 69.3},'
+        b'{"SpatialDim": "KEN", "TimeDim": 2020, "Dim1": "SEX_FMLE", "NumericValue": 68.2}'
+        b']}'
+    )
+
+    df = load_raw_file(payload)
+
+    assert df["Dim1"].tolist() == ["SEX_BTSX"]
+    assert df["SpatialDimCode"].tolist() == ["RWA"]
+
+
+def test_load_raw_file_json_keeps_columns_missing_from_first_row():
+    payload = (
+        b'{"value": ['
+        b'{"SpatialDim": "RWA", "TimeDim": 2020, "Dim1": "SEX_BTSX"},'
+        b'{"SpatialDim": "KEN", "TimeDim": 2020, "Dim1": "SEX_BTSX", "NumericValue": 66.7}'
+        b']}'
+    )
+
+    df = load_raw_file(payload)
+
+    assert df["NumericValue"].iloc[1] == 66.7
+
+
+def test_load_raw_file_json_without_both_sexes_rows_is_empty():
+    payload = b'{"value": [{"SpatialDim": "RWA", "TimeDim": 2020, "Dim1": "SEX_MLE", "NumericValue": 67.1}]}'
+
+    df = load_raw_file(payload)
+
+    assert df.empty
+    assert set(df.columns) >= {"SpatialDim", "SpatialDimCode", "TimeDim", "Dim1", "NumericValue"}
+
+
+def test_load_raw_file_csv_keeps_both_sexes_rows():
+    payload = (
+        b"SpatialDim,SpatialDimCode,TimeDim,Dim1,NumericValue\n"
+        b"Rwanda,RWA,2020,Male,67.1\n"
+        b"Rwanda,RWA,2020,Both sexes,69.3\n"
+    )
+
+    df = load_raw_file(payload)
+
+    assert df["Dim1"].tolist() == ["Both sexes"]
+    assert df["NumericValue"].tolist() == [69.3]
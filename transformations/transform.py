@@ -2,12 +2,14 @@ import os
 import sys
 import logging
 import time
-import json
+import orjson
 import pandas as pd
-from io import StringIO
+from io import BytesIO
 from datetime import datetime
 from minio import Minio
-import psycopg2
+from minio.error import S3Error
+import psycopg
+from psycopg import sql
 
 # Force logs to appear immediately (no buffering when run in Docker)
 sys.stdout.reconfigure(line_buffering=True)
@@ -40,6 +42,21 @@ POSTGRES_USER = os.getenv("POSTGRES_USER", "warehouse_user")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "warehouse_pass")
 # Optional: set MAX_ROWS (e.g. 5000) for a quick run during development
 MAX_ROWS = os.getenv("MAX_ROWS")
+# Raw WHO column -> health_life_expectancy column, in COPY column order
+SCHEMA_COLUMNS = {
+    "SpatialDim": "country_name",
+    "SpatialDimCode": "country_code",
+    "TimeDim": "year",
+    "Dim1": "sex",
+    "NumericValue": "life_expectancy",
+}
+# Postgres types of the health_life_expectancy COPY columns, in COPY column order
+# (ingested_at is not copied; the table default stamps it server-side)
+COPY_TYPES = ["text", "text", "int4", "text", "float8"]
+# Server-side ingested_at default (also in warehouse/init.sql, which only runs on a fresh volume)
+INGESTED_AT_DEFAULT = "(now() AT TIME ZONE 'utc')"
+# Country/year index (also in warehouse/init.sql, which only runs on a fresh volume)
+CC_YEAR_INDEX_DDL = "CREATE INDEX IF NOT EXISTS ix_hle_cc_year ON health_life_expectancy (country_code, year)"
 
 # ------------------------
 # File format detection and loading
@@ -48,22 +65,32 @@ MAX_ROWS = os.getenv("MAX_ROWS")
 # or (2) OData JSON with "value": [ { SpatialDim, TimeDim, Dim1, NumericValue, ... } ]
 # Dim1: CSV uses "Both sexes"; JSON uses "SEX_BTSX" (both), "SEX_FMLE", "SEX_MLE"
 BOTH_SEXES_VALUES = ("Both sexes", "SEX_BTSX")
+# Only these columns are used downstream; the other OData fields are never materialized
+RAW_COLUMNS = ("SpatialDim", "SpatialDimCode", "TimeDim", "Dim1", "NumericValue")
 
 
-def _load_csv(path):
-    """Load WHO CSV format."""
-    return pd.read_csv(path)
+def _load_csv(payload):
+    """Load WHO CSV format from raw bytes (both-sexes rows only)."""
+    df = pd.read_csv(BytesIO(payload))
+    return df[df["Dim1"].isin(BOTH_SEXES_VALUES)]
 
 
-def _load_json(path):
-    """Load WHO OData JSON format (e.g. life_expectancy.csv in parent folder)."""
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    rows = data.get("value", data)
+def _load_json(payload):
+    """Load WHO OData JSON format from raw bytes (both-sexes rows only)."""
+    data = orjson.loads(payload)
+    rows = data.get("value", data) if isinstance(data, dict) else data
     if not rows:
         raise ValueError("JSON has no 'value' array or it is empty")
-    # Normalize to same column names as CSV for rest of pipeline
-    df = pd.DataFrame(rows)
+    # Normalize to same column names as CSV for rest of pipeline; build column-wise,
+    # keeping only RAW_COLUMNS
+    # Filter while iterating the parsed rows so dropped sexes never reach a DataFrame
+    rows = [r for r in rows if r.get("Dim1") in BOTH_SEXES_VALUES]
+    if not rows:
+        # Same shape as the CSV path, so main()'s "no rows left after filtering" check fires
+        return pd.DataFrame(columns=list(RAW_COLUMNS))
+    # A column is kept if any kept row has it (same as the key union pd.DataFrame(rows) used)
+    cols = [c for c in RAW_COLUMNS if any(c in r for r in rows)]
+    df = pd.DataFrame({c: [r.get(c) for r in rows] for c in cols}, copy=False)
     # JSON has SpatialDim (code) but no SpatialDimCode column; use SpatialDim for both
     if "SpatialDimCode" not in df.columns:
         df["SpatialDimCode"] = df["SpatialDim"].astype(str)
@@ -72,15 +99,33 @@ def _load_json(path):
     return df
 
 
-def load_raw_file(path):
-    """Detect JSON vs CSV and return DataFrame with columns: SpatialDim, SpatialDimCode, TimeDim, Dim1, NumericValue."""
-    with open(path, "rb") as f:
-        peek = f.read(50).decode("utf-8", errors="ignore").strip()
-    if peek.startswith("{"):
+def load_raw_file(payload):
+    """Detect JSON vs CSV in raw bytes and return both-sexes rows with columns: SpatialDim, SpatialDimCode, TimeDim, Dim1, NumericValue."""
+    if payload[:50].lstrip().startswith(b"{"):
         logger.info("Detected OData JSON format")
-        return _load_json(path)
+        return _load_json(payload)
     logger.info("Detected CSV format")
-    return _load_csv(path)
+    return _load_csv(payload)
+
+
+# ------------------------
+# Latest raw object lookup
+# ------------------------
+def find_latest_object(client):
+    """Return today's ingestion object if present, else the newest by name (ingestion_date=YYYY-MM-DD sorts lexically)."""
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    try:
+        return client.stat_object(
+            BUCKET_NAME, f"{DATASET_PREFIX}/ingestion_date={today}/life_expectancy.json"
+        )
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+    objects = client.list_objects(BUCKET_NAME, prefix=DATASET_PREFIX, recursive=True)
+    latest_object = max(objects, key=lambda o: o.object_name, default=None)
+    if latest_object is None:
+        raise ValueError(f"No objects under {BUCKET_NAME}/{DATASET_PREFIX}; run ingestion first")
+    return latest_object
 
 
 # ------------------------
@@ -89,21 +134,31 @@ def load_raw_file(path):
 def validate_data(df):
     logging.info("Running data quality checks")
 
-    # Null check
-    if df["NumericValue"].isnull().any():
+    # Null check (on the underlying array; pd.isna also covers object dtype holding None)
+    if pd.isna(df["NumericValue"].to_numpy(copy=False)).any():
         raise ValueError("Null values found in life expectancy")
 
     # Duplicate check (SpatialDimCode = SpatialDim in JSON)
     key_cols = ["SpatialDimCode", "TimeDim", "Dim1"]
     if not all(c in df.columns for c in key_cols):
         key_cols = [c for c in key_cols if c in df.columns]
-    duplicates = df.duplicated(subset=key_cols).sum()
+    # One hash pass over the key columns; number of rows minus distinct keys = duplicates
+    duplicates = len(df) - df.groupby(key_cols, sort=False, dropna=False).ngroups
     if duplicates > 0:
         raise ValueError(f"Duplicate rows detected: {duplicates}")
 
     logging.info("Data quality checks passed")
 
 
+# ------------------------
+# Warehouse load
+# ------------------------
+def copy_rows(clean_df):
+    """Yield clean_df rows for binary COPY, with missing values as None (written as NULL)."""
+    # Binary COPY has no text form for NaN: a NaN in a text column fails to dump
+    return clean_df.astype(object).where(clean_df.notna(), None).itertuples(index=False, name=None)
+
+
 # ------------------------
 # Main Logic
 # ------------------------
@@ -120,51 +175,49 @@ def main():
         secret_key=MINIO_SECRET_KEY,
         secure=False,
     )
-    objects = list(client.list_objects(BUCKET_NAME, prefix=DATASET_PREFIX, recursive=True))
-    latest_object = sorted(objects, key=lambda o: o.last_modified)[-1]
-    logger.info(f"MinIO: found {len(objects)} object(s) in {time.perf_counter() - t0:.1f}s — using {latest_object.object_name}")
+    latest_object = find_latest_object(client)
+    logger.info(f"MinIO: resolved latest object in {time.perf_counter() - t0:.1f}s — using {latest_object.object_name}")
 
-    # --- Step 2: Download to temp file then read (JSON or CSV; format auto-detected) ---
+    # --- Step 2: Read object into memory (JSON or CSV; format auto-detected) ---
     t0 = time.perf_counter()
-    ext = ".json" if latest_object.object_name.endswith(".json") else ".csv"
-    local_path = f"/tmp/life_expectancy_raw{ext}"
     logger.info("Downloading raw data from MinIO...")
     sys.stdout.flush()
-    client.fget_object(BUCKET_NAME, latest_object.object_name, local_path)
-    size_mb = os.path.getsize(local_path) / (1024 * 1024)
+    response = client.get_object(BUCKET_NAME, latest_object.object_name)
+    try:
+        payload = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+    size_mb = len(payload) / (1024 * 1024)
     logger.info(f"Downloaded {size_mb:.1f} MB in {time.perf_counter() - t0:.1f}s, parsing...")
     sys.stdout.flush()
     t_parse = time.perf_counter()
-    df = load_raw_file(local_path)
+    df = load_raw_file(payload)
     logger.info(f"Parsed {len(df)} rows in {time.perf_counter() - t_parse:.1f}s")
 
-    # --- Step 3: Filter (both sexes only) and validate ---
+    # --- Step 3: Validate (both-sexes filter already applied while parsing) ---
     t0 = time.perf_counter()
-    # CSV uses "Both sexes", OData JSON uses "SEX_BTSX"
-    df = df[df["Dim1"].isin(BOTH_SEXES_VALUES)].copy()
     if df.empty:
         raise ValueError("No rows left after filtering for both sexes (Dim1 in %s)" % (BOTH_SEXES_VALUES,))
     if MAX_ROWS:
         df = df.head(int(MAX_ROWS))
         logger.info(f"Limited to {len(df)} rows (MAX_ROWS={MAX_ROWS})")
     validate_data(df)
-    logger.info(f"Filter + validation: {len(df)} rows, {time.perf_counter() - t0:.1f}s")
+    logger.info(f"Validation: {len(df)} rows, {time.perf_counter() - t0:.1f}s")
 
     # --- Step 4: Normalize schema ---
     t0 = time.perf_counter()
-    clean_df = pd.DataFrame({
-        "country_name": df["SpatialDim"],
-        "country_code": df["SpatialDimCode"],
-        "year": df["TimeDim"].astype(int),
-        "sex": df["Dim1"],
-        "life_expectancy": df["NumericValue"].astype(float),
-        "ingested_at": datetime.utcnow(),
-    })
+    # One subset + rename + bulk cast; dtypes match the COPY_TYPES (int4, float8) columns
+    clean_df = (
+        df[list(SCHEMA_COLUMNS)]
+        .rename(columns=SCHEMA_COLUMNS)
+        .astype({"year": "int32", "life_expectancy": "float64"})
+    )
     logger.info(f"Normalized schema: {len(clean_df)} rows in {time.perf_counter() - t0:.1f}s")
 
-    # --- Step 5: Load to PostgreSQL via COPY (much faster than INSERT) ---
+    # --- Step 5: Load to PostgreSQL via binary COPY (no text formatting of floats) ---
     t0 = time.perf_counter()
-    conn = psycopg2.connect(
+    conn = psycopg.connect(
         host=POSTGRES_HOST,
         dbname=POSTGRES_DB,
         user=POSTGRES_USER,
@@ -172,21 +225,51 @@ def main():
     )
     cur = conn.cursor()
 
-    # COPY is 5–20x faster than batched INSERT
-    buffer = StringIO()
-    clean_df.to_csv(
-        buffer,
-        index=False,
-        header=False,
-        date_format="%Y-%m-%d %H:%M:%S",
-        float_format="%.4f",
-    )
-    buffer.seek(0)
-    cur.copy_expert(
-        """COPY health_life_expectancy (country_name, country_code, year, sex, life_expectancy, ingested_at)
-           FROM STDIN WITH (FORMAT csv)""",
-        buffer,
+    # Existing warehouses predate the default and index; add each (in its own short transaction) if missing
+    cur.execute(
+        """SELECT column_default FROM information_schema.columns
+           WHERE table_schema = current_schema()
+             AND table_name = 'health_life_expectancy'
+             AND column_name = 'ingested_at'"""
     )
+    if cur.fetchone()[0] is None:
+        cur.execute(
+            f"ALTER TABLE health_life_expectancy ALTER COLUMN ingested_at SET DEFAULT {INGESTED_AT_DEFAULT}"
+        )
+        conn.commit()
+        logger.info("Set ingested_at default on health_life_expectancy")
+    cur.execute("SELECT to_regclass('ix_hle_cc_year') IS NULL")
+    if cur.fetchone()[0]:
+        cur.execute(CC_YEAR_INDEX_DDL)
+        conn.commit()
+        logger.info("Created index ix_hle_cc_year on health_life_expectancy")
+
+    # Initial load into an empty table: drop secondary indexes and rebuild each in one sorted
+    # pass after COPY. Appends keep them (a rebuild would rescan all accumulated rows), and
+    # the drop's ACCESS EXCLUSIVE lock then only ever blocks readers of an empty table.
+    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM health_life_expectancy)")
+    index_defs = []
+    if cur.fetchone()[0]:
+        cur.execute(
+            """SELECT c.relname, pg_get_indexdef(i.indexrelid)
+               FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+               WHERE i.indrelid = 'health_life_expectancy'::regclass
+                 AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)"""
+        )
+        index_defs = cur.fetchall()
+        for index_name, _ in index_defs:
+            cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(index_name)))
+
+    # COPY is 5–20x faster than batched INSERT; binary format skips CSV serialization entirely
+    with cur.copy(
+        """COPY health_life_expectancy (country_name, country_code, year, sex, life_expectancy)
+           FROM STDIN WITH (FORMAT binary)"""
+    ) as copy:
+        copy.set_types(COPY_TYPES)
+        for row in copy_rows(clean_df):
+            copy.write_row(row)
+    for _, index_def in index_defs:
+        cur.execute(index_def)
     conn.commit()
     cur.close()
     conn.close()
@@ -4,5 +4,9 @@ CREATE TABLE IF NOT EXISTS health_life_expectancy (
     year INT,
     sex TEXT,
     life_expectancy FLOAT,
-    ingested_at TIMESTAMP
+    ingested_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
 );
+
+-- Country/year lookups (the dbt mart's grain)
+CREATE INDEX IF NOT EXISTS ix_hle_cc_year
+    ON health_life_expectancy (country_code, year);